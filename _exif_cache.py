@@ -0,0 +1,95 @@
+"""Persistent cache of dates read from EXIF data.
+
+The cache maps the real path of a file to its modification time, size and
+(year, month) so that unchanged files are not parsed again on later runs.
+Only entries looked up or stored in a run are saved, so entries for files
+that were moved or deleted are dropped.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+import tempfile
+from typing import Dict, List, MutableMapping, Optional, Sequence
+
+CACHE_NAME = '.sort_media_cache.json'
+"""Filename of the cache in the destination directory."""
+
+Cache = MutableMapping[str, List]
+
+
+def open_cache(dest_dir: Path) -> Dict[str, List]:
+    """Load the cache from dest_dir or return an empty cache."""
+    logger = logging.getLogger('exif_cache')
+
+    try:
+        with open(dest_dir / CACHE_NAME) as f:
+            return json.load(f)
+
+    except FileNotFoundError:
+        return {}
+
+    except (OSError, ValueError):
+        logger.warning(f'Ignoring unreadable cache in {dest_dir}')
+        return {}
+
+
+def save_cache(dest_dir: Path, cache: Cache) -> None:
+    """Write the cache to dest_dir if it is a directory."""
+    logger = logging.getLogger('exif_cache')
+
+    if not dest_dir.is_dir():
+        return
+
+    # Write a temporary file and rename it so an interrupted write cannot
+    # leave a truncated cache
+    try:
+        f = tempfile.NamedTemporaryFile('w', dir=dest_dir, suffix='.tmp',
+                                        delete=False)
+
+    except OSError:
+        logger.exception(f'Cannot write cache to {dest_dir}')
+        return
+
+    try:
+        with f:
+            json.dump(dict(cache), f)
+
+        os.replace(f.name, dest_dir / CACHE_NAME)
+
+    except OSError:
+        logger.exception(f'Cannot write cache to {dest_dir}')
+        os.unlink(f.name)
+
+
+def lookup(cache: Cache, src_file: str,
+           stat: os.stat_result) -> Optional[Sequence[str]]:
+    """Return the cached (year, month) for src_file or None.
+
+    A hit is stored again, so if cache is a ChainMap the first map collects
+    every entry used.
+    """
+    key = os.path.realpath(src_file)
+    entry = cache.get(key)
+
+    if entry and entry[:2] == [stat.st_mtime_ns, stat.st_size]:
+        cache[key] = entry
+        return tuple(entry[2:])
+
+    return None
+
+
+def store(cache: Cache, src_file: str, stat: os.stat_result,
+          year_month: Sequence[str]) -> None:
+    """Add the (year, month) for src_file to the cache."""
+    cache[os.path.realpath(src_file)] = [stat.st_mtime_ns, stat.st_size,
+                                         *year_month]
+
+
+def rename(cache: Cache, src_file: str, dest_file: str) -> None:
+    """Key the entry for src_file, if any, by dest_file after a move."""
+    entry = cache.pop(os.path.realpath(src_file), None)
+
+    if entry is not None:
+        cache[os.path.realpath(dest_file)] = entry
@@ -1,19 +1,26 @@
-"""Find duplicate filenames in dest_dir.
+"""Find files with the same contents in dest_dir.
 
-If src_dir is specified, say if filenames in src_dir are NOT in dest_dir.
+If src_dir is specified, say if files in src_dir are NOT in dest_dir.
 """
 
 import argparse
 from collections import defaultdict
+import hashlib
 import logging
 import os
 from pathlib import Path
 import sys
-from typing import DefaultDict, List
+from typing import DefaultDict, Dict, Iterable, List, Optional
 
-from sort_media import get_paths, setup_logging
+from sort_media import get_entries, setup_logging
 
-__version__ = '0.1'
+__version__ = '0.2'
+
+QUICK_HASH_SIZE = 64 * 1024
+"""Number of bytes hashed to tell apart files of the same size."""
+
+CHUNK_SIZE = 1024 * 1024
+"""Number of bytes read at a time when hashing whole files."""
 
 
 def parse_args() -> argparse.Namespace:
@@ -38,28 +45,149 @@ def parse_args() -> argparse.Namespace:
     return args
 
 
+def file_hash(path: str, size: int=-1) -> bytes:
+    """Return the BLAKE2b digest of the first size bytes of the file at path,
+    or of the whole file if size is negative.
+    """
+    digest = hashlib.blake2b()
+
+    with open(path, 'rb') as f:
+        if size >= 0:
+            digest.update(f.read(size))
+
+        else:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+    return digest.digest()
+
+
+def _try_file_hash(path: str, size: int=-1) -> Optional[bytes]:
+    """Return file_hash(path, size), or None if the file cannot be read."""
+    try:
+        return file_hash(path, size)
+
+    except OSError as ex:
+        logging.getLogger('find_duplicates').warning(
+            f'Skipping {path}: {ex}')
+        return None
+
+
+def group_by_size(entries: Iterable[os.DirEntry]) -> Dict[int, List[str]]:
+    """Map file size to the paths of entries with that size.
+
+    Symbolic links are measured by the file they point to. Empty files,
+    files that cannot be read, and extra links to the same file are left
+    out.
+    """
+    logger = logging.getLogger('find_duplicates')
+    size_to_paths = defaultdict(list)  # type: DefaultDict[int, List[str]]
+    inodes = set()
+
+    for entry in entries:
+        # A stat system call on POSIX, where scandir() only gives the file
+        # type. On Windows scandir() gives the rest, except for links.
+        try:
+            stat = entry.stat()
+
+        except OSError as ex:
+            logger.warning(f'Skipping {entry.path}: {ex}')
+            continue
+
+        if not stat.st_size:
+            continue
+
+        # st_ino is 0 on some platforms, so cannot always be used
+        if stat.st_ino:
+            inode = (stat.st_dev, stat.st_ino)
+            if inode in inodes:
+                continue
+            inodes.add(inode)
+
+        size_to_paths[stat.st_size].append(entry.path)
+
+    return size_to_paths
+
+
+def group_by_hash(paths: Iterable[str], size: int=-1) -> List[List[str]]:
+    """Return groups of more than one path with the same file_hash."""
+    hash_to_paths = defaultdict(list)  # type: DefaultDict[bytes, List[str]]
+
+    for path in paths:
+        digest = _try_file_hash(path, size)
+        if digest is not None:
+            hash_to_paths[digest].append(path)
+
+    return [group for group in hash_to_paths.values() if len(group) > 1]
+
+
+def find_duplicates(size_to_paths: Dict[int, List[str]]) -> List[List[str]]:
+    """Return groups of paths with the same contents.
+
+    size_to_paths is a map from file size to paths from group_by_size().
+    """
+    duplicates = []
+
+    for size, paths in size_to_paths.items():
+        # Only files of the same size can be duplicates
+        if len(paths) < 2:
+            continue
+
+        # Hash the start of the files first as it is quicker and usually
+        # enough to tell them apart
+        for group in group_by_hash(paths, QUICK_HASH_SIZE):
+            if size <= QUICK_HASH_SIZE:
+                duplicates.append(group)
+            else:
+                duplicates.extend(group_by_hash(group))
+
+    return duplicates
+
+
 def main() -> int:
     setup_logging()
     args = parse_args()
     logger = logging.getLogger('main')
 
-    name_to_dirs = defaultdict(list)  # type: DefaultDict[str, List[Path]]
-    """Map of filename to list of directories in which filename was found."""
+    size_to_paths = group_by_size(get_entries(args.dest))
 
-    # Walk the directory tree adding directories to filename keys
-    for path in get_paths(args.dest):
-        name_to_dirs[path.name].append(path.parent)
-
-    for name, dirs in name_to_dirs.items():
-        # If the filename was found in more than 1 directory, warn as
-        # possible duplicate
-        if len(dirs) > 1:
-            logger.warning(f'{name} found in f{dirs}')
+    for group in find_duplicates(size_to_paths):
+        logger.warning(f'Same contents in {group}')
 
     if args.src:
-        for path in get_paths(args.src):
-            if path.name not in name_to_dirs:
-                logger.info(f'{path.name} NOT found in {args.dest}')
+        dest_hashes = {}  # type: Dict[str, Optional[bytes]]
+        """Map of path in dest_dir to file_hash, computed as needed."""
+
+        for entry in get_entries(args.src):
+            try:
+                size = entry.stat().st_size
+
+            except OSError as ex:
+                logger.warning(f'Skipping {entry.path}: {ex}')
+                continue
+
+            if not size:
+                continue
+
+            # Only hash the file if dest_dir has files of the same size
+            found = False
+            paths = size_to_paths.get(size, [])
+
+            if paths:
+                src_hash = _try_file_hash(entry.path)
+                if src_hash is None:
+                    continue
+
+                for path in paths:
+                    if path not in dest_hashes:
+                        dest_hashes[path] = _try_file_hash(path)
+
+                    if dest_hashes[path] == src_hash:
+                        found = True
+                        break
+
+            if not found:
+                logger.info(f'{entry.path} NOT found in {args.dest}')
 
     logger.info('Finished successfully')
     return 0
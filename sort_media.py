@@ -1,26 +1,79 @@
 """Copy or move images into year/month directories."""
 
 import argparse
+from collections import ChainMap
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
 from datetime import date
+import errno
+import functools
+import itertools
 import json
 import logging
 import logging.config
+import logging.handlers
+import multiprocessing
 import os
 from pathlib import Path
 import re
 import shutil
+import stat
 import struct
 import sys
-from typing import Iterator, Sequence
+import threading
+from typing import (Callable, Container, Dict, Iterable, Iterator, List,
+                    Optional, Pattern, Sequence, Set, Tuple)
 
 import piexif
 
+import _exif_cache
+
 __version__ = '1.5'
 
 # http://www.awaresystems.be/imaging/tiff/tifftags/privateifd/exif/datetimeoriginal.html
 DATETIME_ORIGINAL = 36867
 """EXIF key for original date time of photo."""
 
+# http://www.awaresystems.be/imaging/tiff/tifftags/exififd.html
+EXIF_IFD_POINTER = 34665
+"""TIFF key for the offset of the EXIF IFD."""
+
+# TIFF field types used to check tags before reading them
+TIFF_ASCII = 2
+TIFF_LONG = 4
+TIFF_IFD = 13
+
+EXIF_HEAD_SIZE = 128 * 1024
+"""Number of bytes read from the start of a JPEG to find the EXIF data."""
+
+EXIF_SUFFIXES = ('.jpg', '.jpeg', '.tif', '.tiff', '.webp')
+"""Lower case file extensions of images that may contain EXIF data."""
+
+JPEG_SOI = b'\xff\xd8'
+"""Start of image marker at the start of every JPEG file."""
+
+JPEG_SOS = b'\xff\xda'
+"""Start of scan marker after which there are no more JPEG metadata."""
+
+JPEG_APP1 = b'\xff\xe1'
+"""Marker of the JPEG application segment containing EXIF data."""
+
+_USE_SENDFILE = hasattr(os, 'sendfile') and sys.platform.startswith('linux')
+"""True if os.sendfile can copy between files on this platform."""
+
+_SENDFILE_UNSUPPORTED = {errno.ENOTSOCK, errno.EINVAL, errno.ENOSYS,
+                         errno.ENOTSUP, errno.EOPNOTSUPP, errno.EXDEV}
+"""Error numbers meaning os.sendfile does not support the files."""
+
+COPY_THREADS = 8
+"""Number of threads copying or moving files while dates are found."""
+
+COPY_QUEUE_SIZE = 256
+"""Maximum number of files waiting to be copied or moved."""
+
+WORKER_CHUNK_SIZE = 32
+"""Number of files sent to a worker process at a time."""
+
 # Warn if year of file creation is unlikely
 YEAR_MAX = date.today().year + 1
 YEAR_MIN = 1945
@@ -40,6 +93,39 @@ IGNORED = (
     )
 """Sequence of directory and file names to ignore."""
 
+# No leading digit, then 1 or 2 followed by 3 digits (for years 1ddd and
+# 2ddd), then any of -:\/ then 2 digits, then any of -:\/ then optional 2
+# digits, then no trailing digits
+_DATE_RE = re.compile(
+    r'(?<!\d)([12]\d{3})[-:\\/]?(\d{2})[-:\\/]?(?:\d{2})?(?!\d)')
+"""Regular expression matching the year and month in date_from_str()."""
+
+_cache = {}  # type: _exif_cache.Cache
+"""EXIF dates from previous runs, set by _init_cache()."""
+
+_ensured_dirs = set()  # type: Set[str]
+"""Destination directories already created by this process."""
+
+_claimed_files = set()  # type: Set[str]
+"""Destination files that copy() has already used in this process."""
+
+_claimed_lock = threading.Lock()
+"""Lock for _claimed_files, as copy() may run in several threads."""
+
+
+def positive_int(text: str) -> int:
+    """Return text as an int, for argparse, if it is greater than zero."""
+    try:
+        value = int(text)
+
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid int value: {text!r}')
+
+    if value < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1: {value}')
+
+    return value
+
 
 def parse_args() -> argparse.Namespace:
     """Parse command line arguments."""
@@ -59,6 +145,10 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument('-d', '--dest', default=os.curdir,
                         type=Path, help=msg)
 
+    msg = 'number of worker processes. Default is the number of CPUs.'
+    parser.add_argument('-w', '--workers', default=os.cpu_count() or 1,
+                        type=positive_int, help=msg)
+
     return parser.parse_args()
 
 
@@ -77,67 +167,209 @@ def setup_logging() -> None:
         logging.basicConfig(level=level, format=fmt, datefmt='%H:%M:%S')
 
 
+@functools.lru_cache(maxsize=None)
+def _compile_ignored(ignored: Sequence[str]) -> Pattern:
+    """Compile the ignored patterns into a single regular expression."""
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in ignored))
+
+
+# IGNORED split into checks that need no regular expression. Keep in step
+# with IGNORED, which is still used when ignore() is given other patterns.
+_IGNORED_SUFFIXES = ('.ini', '.db', '.json', '.log', '.rss', '.url', '.pmp')
+_IGNORED_NAMES = ('Picasa2', '.Picasa3Temp')
+
+
 def ignore(path: str, *, ignored: Sequence[str]=IGNORED) -> bool:
     """Return True if path should be ignored, False otherwise."""
-    return any(re.search(pattern, path) for pattern in ignored)
+    if ignored is IGNORED:
+        return (path.endswith(_IGNORED_SUFFIXES) or
+                any(name in path for name in _IGNORED_NAMES) or
+                '.' not in path)
+
+    return _compile_ignored(tuple(ignored)).search(path) is not None
+
+
+def _scandir_recursive(path: str) -> Iterator[os.DirEntry]:
+    """Generate file entries under path, pruning ignored directories."""
+    logger = logging.getLogger('get_paths')
+
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+
+    except OSError:
+        logger.warning(f'Cannot read directory: {path}')
+        return
+
+    # Checked once per directory rather than once per entry
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    for entry in entries:
+        if ignore(entry.path):
+            if debug:
+                logger.debug('Ignoring: %s', entry.path)
+            continue
+
+        if entry.is_dir():
+            # Do not follow symbolic links to directories, like os.walk
+            if not entry.is_symlink():
+                yield from _scandir_recursive(entry.path)
+
+        else:
+            yield entry
+
+
+def get_entries(src_dir: Path) -> Iterator[os.DirEntry]:
+    """Generate os.DirEntry objects for valid files under src_dir.
+
+    The entries cache their stat() results so can be cheaper than paths.
+    """
+    return _scandir_recursive(os.fspath(src_dir))
 
 
 def get_paths(src_dir: Path) -> Iterator[Path]:
     """Generate valid file paths under the src_dir directory."""
-    logger = logging.getLogger('get_paths')
+    for entry in get_entries(src_dir):
+        yield Path(entry.path)
+
+
+def _find_tag(data: bytes, ifd: int, endian: str, tag: int,
+              value_types: Container[int]) -> Tuple[int, int]:
+    """Return (count, value) for tag in the TIFF IFD at offset ifd in data.
+
+    value is the 4 byte value, or offset of the value, as an integer.
+    Raise KeyError if tag is missing or ValueError if its type is not one of
+    value_types.
+    """
+    num_entries, = struct.unpack_from(endian + 'H', data, ifd)
+
+    for offset in range(ifd + 2, ifd + 2 + 12 * num_entries, 12):
+        entry_tag, value_type, count, value = struct.unpack_from(
+            endian + 'HHLL', data, offset)
+
+        if entry_tag == tag:
+            if value_type not in value_types:
+                raise ValueError(f'Unexpected type {value_type} for {tag}')
+
+            return count, value
+
+    raise KeyError(tag)
+
+
+def _fast_datetime_original(data: bytes) -> Optional[str]:
+    """Get DateTimeOriginal from the start of JPEG data without using piexif.
+
+    Only the JPEG segments and the two IFDs leading to the tag are read.
+    Return None if data is not a JPEG, is too short to be sure or has tags
+    of an unexpected type or size.
+    Raise KeyError if the JPEG has no DateTimeOriginal.
+    """
+    if not data.startswith(JPEG_SOI):
+        return None
+
+    try:
+        # Find the EXIF segment
+        pos = len(JPEG_SOI)
+        while True:
+            marker, length = struct.unpack_from('>2sH', data, pos)
+
+            if marker == JPEG_SOS:
+                raise KeyError('No EXIF segment')
+
+            if marker == JPEG_APP1 and data[pos + 4:pos + 10] == b'Exif\0\0':
+                break
+
+            pos += len(marker) + length
 
-    for root, dirs, files in os.walk(src_dir):
-        # Remove hidden directories
-        for dirname in dirs:
-            path = os.path.join(root, dirname)
-            if ignore(path):
-                logger.debug(f'Ignoring directory: {path}')
-                dirs.remove(dirname)
+        # Offsets in EXIF data are from the start of the TIFF header
+        tiff = pos + 10
+        endian = {b'II': '<', b'MM': '>'}.get(data[tiff:tiff + 2])
+        if endian is None:
+            return None
 
-        for fname in files:
-            path = os.path.join(root, fname)
-            if ignore(path):
-                logger.debug(f'Ignoring file: {path}')
-                continue
+        ifd0, = struct.unpack_from(endian + 'L', data, tiff + 4)
+        _, exif_ifd = _find_tag(data, tiff + ifd0, endian, EXIF_IFD_POINTER,
+                                (TIFF_LONG, TIFF_IFD))
+        count, offset = _find_tag(data, tiff + exif_ifd, endian,
+                                  DATETIME_ORIGINAL, (TIFF_ASCII,))
 
-            yield Path(root, fname)
+        # A well formed value is 20 bytes including the NUL, so is stored at
+        # offset. Leave shorter, inline values to piexif.
+        if count <= 4:
+            return None
 
+        value = data[tiff + offset:tiff + offset + count]
+        if len(value) != count:
+            return None
 
-def date_from_exif(src_file: Path) -> Sequence[str]:
-    """Get the date tuple (year, month) from JPEG EXIF data."""
+        return value.rstrip(b'\0').decode()
+
+    except (struct.error, ValueError):
+        # Includes malformed tags and UnicodeDecodeError
+        return None
+
+
+def _read_datetime_original(src_file: str) -> str:
+    """Read DateTimeOriginal from as little of src_file as possible."""
+    with open(src_file, 'rb') as f:
+        head = f.read(EXIF_HEAD_SIZE)
+
+    text = _fast_datetime_original(head)
+    if text is not None:
+        return text
+
+    # piexif treats bytes that are not JPEG data as a filename
+    if head.startswith(JPEG_SOI):
+        try:
+            return piexif.load(head)['Exif'][DATETIME_ORIGINAL].decode()
+
+        except (struct.error, ValueError):
+            # EXIF data may extend beyond the head, so read the whole file
+            pass
+
+    # piexif needs a str filename, not a Path
+    exif = piexif.load(os.fspath(src_file))
+    return exif['Exif'][DATETIME_ORIGINAL].decode()
+
+
+def date_from_exif(src_file: str, cache: Optional[_exif_cache.Cache]=None,
+                   src_stat: Optional[os.stat_result]=None) -> Sequence[str]:
+    """Get the date tuple (year, month) from JPEG EXIF data.
+
+    If cache is given, it is checked before reading the file and updated
+    with the date found. src_stat is the os.stat() result for src_file if
+    already known.
+    """
     logger = logging.getLogger('date_from_exif')
 
     try:
-        exif = piexif.load(str(src_file))
-        return date_from_str(exif['Exif'][DATETIME_ORIGINAL].decode())
+        if cache is not None:
+            if src_stat is None:
+                src_stat = os.stat(src_file)
 
-    except struct.error:
-        logger.debug(f'struct.error parsing {src_file}')
-        raise
+            year_month = _exif_cache.lookup(cache, src_file, src_stat)
+            if year_month:
+                return year_month
 
-    except KeyError:
-        logger.debug(f'No date in EXIF for {src_file}')
-        raise
+        year_month = date_from_str(_read_datetime_original(src_file))
 
-    except ValueError as ex:
-        ex_type = ex.__class__.__name__
-        logger.debug(f'{ex_type}: {ex} when reading {src_file}')
-        raise
+        if cache is not None:
+            _exif_cache.store(cache, src_file, src_stat, year_month)
 
-    except Exception:
-        logger.exception('Unexpected exception')
+        return year_month
+
+    except (struct.error, KeyError, ValueError) as ex:
+        # Expected for files without EXIF dates. Do not log the traceback
+        # as formatting it is slow.
+        logger.debug('%s: %s when reading %s', ex.__class__.__name__, ex,
+                     src_file)
         raise
 
 
 def date_from_str(text: str) -> Sequence[str]:
     """Get the date tuple (year, month) from the text string."""
     logger = logging.getLogger('date_from_str')
-
-    # No leading digit, then 1 or 2 followed by 3 digits (for years 1ddd and
-    # 2ddd), then any of -:\/ then 2 digits, then any of -:\/ then optional 2
-    # digits, then no trailing digits
-    pattern = r'(?<!\d)([12]\d{3})[-:\\/]?(\d{2})[-:\\/]?(?:\d{2})?(?!\d)'
-    match = re.search(pattern, text)
+    match = _DATE_RE.search(text)
 
     if match:
         return match.group(1, 2)
@@ -148,27 +380,164 @@ def date_from_str(text: str) -> Sequence[str]:
         raise ValueError(msg)
 
 
-def copy(src_file: Path, dest_dir: Path, mode: str='dryrun') -> None:
+def _copy_file(src_file: str, dest_file: str,
+               src_stat: os.stat_result) -> None:
+    """Copy the data and times of src_file to the new file dest_file.
+
+    src_stat is the os.stat() result for src_file.
+    """
+    with open(src_file, 'rb') as fsrc:
+        # Exclusive creation so an existing file is never overwritten
+        fdest = open(dest_file, 'xb')
+
+        try:
+            with fdest:
+                copied = _USE_SENDFILE and _sendfile(
+                    fsrc.fileno(), fdest.fileno(), src_stat.st_size)
+
+            if not copied:
+                # Overwrites only the empty file created above. copyfile
+                # uses the fastest copy for the platform.
+                shutil.copyfile(src_file, dest_file)
+
+            os.utime(dest_file,
+                     ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+
+        except BaseException:
+            # Do not leave a partial copy that later runs would skip
+            try:
+                os.unlink(dest_file)
+            except OSError:
+                pass
+            raise
+
+
+def _sendfile(src_fd: int, dest_fd: int, size: int) -> bool:
+    """Copy size bytes from src_fd to dest_fd in the kernel.
+
+    Return False if os.sendfile cannot be used for these files.
+    """
+    offset = 0
+
+    try:
+        while offset < size:
+            sent = os.sendfile(dest_fd, src_fd, offset, size - offset)
+            if not sent:
+                break
+            offset += sent
+
+    except OSError as ex:
+        # The errors shutil also treats as sendfile being unsupported
+        if ex.errno in _SENDFILE_UNSUPPORTED:
+            return False
+        raise
+
+    return True
+
+
+def _move_file(src_file: str, dest_file: str,
+               src_stat: os.stat_result) -> None:
+    """Move src_file to the new file dest_file.
+
+    src_stat is the os.stat() result for src_file. The data is only copied
+    if dest_file is on a different file system.
+    """
+    try:
+        # Unlike a rename, a hard link fails if dest_file exists, so an
+        # existing file is never overwritten
+        os.link(src_file, dest_file)
+
+    except FileExistsError:
+        raise
+
+    except OSError as ex:
+        if ex.errno != errno.EXDEV:
+            # No hard links on this file system, such as FAT, so rename.
+            # copy() has checked and claimed dest_file under _claimed_lock.
+            os.rename(src_file, dest_file)
+            return
+
+        # Different file systems, so copy instead
+        _copy_file(src_file, dest_file, src_stat)
+
+    os.unlink(src_file)
+
+
+def _write_file(write: Callable[[str, str, os.stat_result], None],
+                src_file: str, dest_file: str,
+                src_stat: os.stat_result) -> None:
+    """Call write(src_file, dest_file, src_stat).
+
+    If the directory of dest_file has gone, create it and try once more.
+    """
+    try:
+        write(src_file, dest_file, src_stat)
+
+    except FileNotFoundError:
+        # _ensured_dirs may be out of date, for example after rmdirs()
+        dest_dir = os.path.dirname(dest_file)
+        if os.path.isdir(dest_dir):
+            raise
+
+        os.makedirs(dest_dir, exist_ok=True)
+        write(src_file, dest_file, src_stat)
+
+
+def copy(src_file: str, dest_dir: str, mode: str='dryrun',
+         src_stat: Optional[os.stat_result]=None,
+         remove_empty: bool=True) -> Optional[str]:
     """Copy or move file from src_file to dest directory.
     src_file - source filename
     dest_dir - destination directory
+    src_stat - os.stat() result for src_file if already known
+    remove_empty - remove source directories left empty by a move
+
+    Return the new file, or None if nothing was copied or moved.
+    Copies keep the access and modification times but not the permissions.
     """
     logger = logging.getLogger('copy')
-    dest_file = dest_dir / src_file.name
+    dest_file = os.path.join(dest_dir, os.path.basename(src_file))
 
     if src_file == dest_file:
-        logger.debug(f'{src_file} already at {dest_file}')
+        logger.debug('%s already at %s', src_file, dest_file)
         return
 
-    # Warn if there is alrady a file in the destination
-    if dest_file.is_file():
-        logger.error(f'{src_file} already at {dest_file}')
-        return
+    # Warn if there is alrady a file in the destination, including one
+    # being copied by another thread
+    with _claimed_lock:
+        try:
+            dest_stat = os.stat(dest_file)
+            dest_mode = dest_stat.st_mode
+
+        except OSError:
+            dest_stat = None
+            dest_mode = 0
+
+        # The same file by another path, such as through a link
+        if stat.S_ISREG(dest_mode):
+            try:
+                if src_stat is None:
+                    src_stat = os.stat(src_file)
+                same = os.path.samestat(src_stat, dest_stat)
+
+            except OSError:
+                same = False
+
+            if same:
+                logger.debug('%s already at %s', src_file, dest_file)
+                return
+
+        if dest_file in _claimed_files or stat.S_ISREG(dest_mode):
+            logger.error(f'{src_file} already at {dest_file}')
+            return
+
+        _claimed_files.add(dest_file)
 
     # If file is not in the correct directory, make the directory(s)
-    if not mode == 'dryrun':
+    if not mode == 'dryrun' and dest_dir not in _ensured_dirs:
         try:
-            dest_dir.mkdir(parents=True, exist_ok=True)
+            os.makedirs(dest_dir, exist_ok=True)
+            _ensured_dirs.add(dest_dir)
 
         except OSError:
             logger.exception(f'Cannot create {dest_dir}')
@@ -178,21 +547,34 @@ def copy(src_file: Path, dest_dir: Path, mode: str='dryrun') -> None:
         if mode == 'copy':
             # If the destination filename is already a directory, change
             # the filename to avoid a conflict
-            dest_file = avoid_conflict(dest_file)
+            if stat.S_ISDIR(dest_mode):
+                dest_file = avoid_conflict(dest_file)
 
-            shutil.copy2(str(src_file), str(dest_file))
+            # Copy the data and times only because other metadata does not
+            # matter for media
+            if src_stat is None:
+                src_stat = os.stat(src_file)
+
+            _write_file(_copy_file, src_file, dest_file, src_stat)
             logger.info(f'Copied {src_file} to {dest_file}')
-            return
+            return dest_file
 
         elif mode == 'move':
             # If the destination filename is already a directory, change
             # the filename to avoid a conflict
-            dest_file = avoid_conflict(dest_file)
+            if stat.S_ISDIR(dest_mode):
+                dest_file = avoid_conflict(dest_file)
+
+            if src_stat is None:
+                src_stat = os.stat(src_file)
 
-            shutil.move(str(src_file), str(dest_file))
+            _write_file(_move_file, src_file, dest_file, src_stat)
             logger.info(f'Moved {src_file} to {dest_file}')
-            rmdirs(src_file)
-            return
+
+            if remove_empty:
+                rmdirs(src_file)
+
+            return dest_file
 
         else:
             msg = f'Would have moved or copied {src_file} to {dest_file}'
@@ -204,54 +586,223 @@ def copy(src_file: Path, dest_dir: Path, mode: str='dryrun') -> None:
         return
 
 
-def avoid_conflict(path: Path) -> Path:
+def avoid_conflict(path: str) -> str:
     """Add an underscore if path is already a directory."""
-    if path.is_dir():
-        return avoid_conflict(path.parent / Path('_' + path.name))
+    if os.path.isdir(path):
+        head, tail = os.path.split(path)
+        return avoid_conflict(os.path.join(head, '_' + tail))
 
     else:
         return path
 
 
-def rmdirs(src_file: Path) -> None:
+def rmdirs(src_file: str) -> None:
     """Remove parent directories if empty."""
-    for parent in src_file.parents:
+    parent = os.path.dirname(src_file)
+
+    while parent:
         try:
             os.rmdir(parent)
 
         except OSError:
             pass
 
+        if parent == os.path.dirname(parent):
+            break
 
-def main() -> int:
-    setup_logging()
-    args = parse_args()
+        parent = os.path.dirname(parent)
+
+
+def _get_dest_dir(src_file: str, dest: str
+                  ) -> Tuple[str, Optional[os.stat_result], Optional[str],
+                             _exif_cache.Cache]:
+    """Get the year/month directory under dest for src_file.
+
+    Return src_file, its os.stat() result, the directory or None if no date
+    was found, and the EXIF cache entries looked up or added.
+    """
     logger = logging.getLogger('main')
 
-    for src_file in get_paths(args.src):
+    # Collect the cache entries used separately so they can be returned to
+    # the main process
+    cache = ChainMap({}, _cache)
+
+    # Stat once here for both the EXIF cache and copy()
+    try:
+        src_stat = os.stat(src_file)
+
+    except OSError:
+        logger.warning(f'Cannot read {src_file}')
+        return src_file, None, None, cache.maps[0]
+
+    parent, name = os.path.split(src_file)
+    stem, ext = os.path.splitext(name)
+
+    try:
+        # Try getting year and month from filename, which needs no I/O
+        year, month = date_from_str(stem)
+
+    except Exception:
         try:
             # Try getting year and month from EXIF data
-            year, month = date_from_exif(src_file)
+            if ext.lower() not in EXIF_SUFFIXES:
+                raise ValueError(f'No EXIF data in {src_file}')
+
+            year, month = date_from_exif(src_file, cache, src_stat)
 
         except Exception:
             try:
-                # Try getting year and month from filename
-                year, month = date_from_str(src_file.stem)
+                # Try getting date from source directory name(s)
+                year, month = date_from_str(parent)
 
             except Exception:
-                try:
-                    # Try getting date from source directory name(s)
-                    year, month = date_from_str(str(src_file.parent))
+                logger.warning(f'Could not get date for {src_file}')
+                return src_file, src_stat, None, cache.maps[0]
+
+    if YEAR_MAX < int(year) < YEAR_MIN:
+        logger.warning(f'Year {year} found for {src_file}')
+
+    dest_dir = os.path.join(dest, year, month)
+    return src_file, src_stat, dest_dir, cache.maps[0]
+
+
+def _get_dest_dirs(src_files: Sequence[str], dest: str
+                   ) -> List[Tuple[str, Optional[os.stat_result],
+                                   Optional[str], _exif_cache.Cache]]:
+    """Return the results of _get_dest_dir() for each of src_files."""
+    return [_get_dest_dir(src_file, dest) for src_file in src_files]
+
+
+def _init_cache(cache: _exif_cache.Cache) -> None:
+    """Set the EXIF cache used by _get_dest_dir()."""
+    global _cache
+    _cache = cache
 
-                except Exception:
-                    logger.warning(f'Could not get date for {src_file}')
-                    continue
 
-        if YEAR_MAX < int(year) < YEAR_MIN:
-            logger.warning(f'Year {year} found for {src_file}')
+def _init_worker(queue: multiprocessing.Queue, level: int,
+                 cache: _exif_cache.Cache) -> None:
+    """Send log records from a worker process to queue."""
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(queue)]
+    root.setLevel(level)
+    _init_cache(cache)
+
+
+def main() -> int:
+    setup_logging()
+    args = parse_args()
+    logger = logging.getLogger('main')
+
+    # Plain strings are cheaper than Path objects for each file
+    src_files = (entry.path for entry in get_entries(args.src))
+
+    dest = os.fspath(args.dest)
+    cache = _exif_cache.open_cache(args.dest)
+
+    # Only entries for files seen in this run are saved, keyed by where
+    # the files are at the end of the run
+    used_entries = {}  # type: Dict[str, List]
+
+    if args.workers == 1:
+        _init_cache(cache)
+        for src_file in src_files:
+            src_file, src_stat, dest_dir, entries = _get_dest_dir(src_file,
+                                                                  dest)
+            used_entries.update(entries)
+
+            if dest_dir:
+                dest_file = copy(src_file, dest_dir, args.mode, src_stat)
+
+                if dest_file and args.mode == 'move':
+                    _exif_cache.rename(used_entries, src_file, dest_file)
+
+    else:
+        # Log records from the workers are handled in this process so that
+        # output from different files is not interleaved
+        root = logging.getLogger()
+
+        # The listener and copy threads run while the workers start, and
+        # forking a process with threads can deadlock, so spawn the workers
+        context = multiprocessing.get_context('spawn')
+        queue = context.Queue()
+        listener = logging.handlers.QueueListener(
+            queue, *root.handlers, respect_handler_level=True)
+        listener.start()
+
+        # Files are copied in threads while the workers find the dates of
+        # the next files. Limit the chunks sent to the workers and the files
+        # waiting to be copied so memory use is bounded.
+        max_chunks = 2 * args.workers
+        slots = threading.BoundedSemaphore(COPY_QUEUE_SIZE)
+        get_dest_dirs = functools.partial(_get_dest_dirs, dest=dest)
+
+        # A moved file from each source directory. The directories are
+        # removed if empty only after all copy threads have finished, as
+        # another thread may be creating or writing to one of them.
+        moved_from = {}  # type: Dict[str, str]
+
+        # used_entries and moved_from are changed by the copy threads
+        entries_lock = threading.Lock()
+
+        def copy_done(src_file: str, future: Future) -> None:
+            slots.release()
+            if future.exception():
+                logger.error('Unexpected exception',
+                             exc_info=future.exception())
+
+            elif future.result() and args.mode == 'move':
+                with entries_lock:
+                    _exif_cache.rename(used_entries, src_file,
+                                       future.result())
+                    moved_from[os.path.dirname(src_file)] = src_file
+
+        def start_copies(futures: Iterable[Future]) -> None:
+            for future in futures:
+                for src_file, src_stat, dest_dir, entries in future.result():
+                    with entries_lock:
+                        used_entries.update(entries)
+
+                    if dest_dir:
+                        slots.acquire()
+                        copy_future = copier.submit(copy, src_file, dest_dir,
+                                                    args.mode, src_stat,
+                                                    remove_empty=False)
+                        copy_future.add_done_callback(
+                            functools.partial(copy_done, src_file))
+
+        try:
+            with ProcessPoolExecutor(max_workers=args.workers,
+                                     mp_context=context,
+                                     initializer=_init_worker,
+                                     initargs=(queue, root.level, cache)
+                                     ) as ex, \
+                    ThreadPoolExecutor(max_workers=COPY_THREADS) as copier:
+                pending = set()  # type: Set[Future]
+
+                while True:
+                    chunk = list(itertools.islice(src_files,
+                                                  WORKER_CHUNK_SIZE))
+                    if not chunk:
+                        break
+
+                    pending.add(ex.submit(get_dest_dirs, chunk))
+
+                    if len(pending) >= max_chunks:
+                        done, pending = wait(pending,
+                                             return_when=FIRST_COMPLETED)
+                        start_copies(done)
+
+                start_copies(wait(pending).done)
+
+        finally:
+            listener.stop()
+
+        for src_file in moved_from.values():
+            rmdirs(src_file)
 
-        dest_dir = args.dest / year / month
-        copy(src_file, dest_dir, args.mode)
+    # A dry run must not change anything
+    if args.mode != 'dryrun':
+        _exif_cache.save_cache(args.dest, used_entries)
 
     logger.info('Finished successfully')
     return 0
@@ -0,0 +1,52 @@
+"""Unit tests for the find_duplicates module."""
+
+import os
+from pathlib import Path
+import tempfile
+import unittest
+
+import find_duplicates
+import sort_media
+
+
+class TestFindDuplicates(unittest.TestCase):
+
+    def test_find_duplicates(self):
+        # Paths without a dot are ignored, so give the root directory one
+        with tempfile.TemporaryDirectory(suffix='.test') as root:
+            size = find_duplicates.QUICK_HASH_SIZE + 1
+            contents = {
+                'a.jpg': b'a' * size,
+                'b.jpg': b'a' * size,
+                'c.jpg': b'a' * (size - 1) + b'c',
+                'd.jpg': b'd',
+                'e.jpg': b'd',
+                'empty1.jpg': b'',
+                'empty2.jpg': b'',
+            }
+
+            for name, data in contents.items():
+                Path(root, name).write_bytes(data)
+
+            # Links are the same file, not duplicates
+            os.link(Path(root, 'c.jpg'), Path(root, 'link.jpg'))
+            os.symlink(Path(root, 'c.jpg'), Path(root, 'symlink1.jpg'))
+            os.symlink(Path(root, 'c.jpg'), Path(root, 'symlink2.jpg'))
+
+            # Files that cannot be read are skipped
+            os.symlink(Path(root, 'missing'), Path(root, 'broken.jpg'))
+
+            with self.assertLogs('find_duplicates', 'WARNING'):
+                size_to_paths = find_duplicates.group_by_size(
+                    sort_media.get_entries(Path(root)))
+            result = {frozenset(os.path.basename(path) for path in group)
+                      for group in find_duplicates.find_duplicates(
+                          size_to_paths)}
+
+            expected = {frozenset(('a.jpg', 'b.jpg')),
+                        frozenset(('d.jpg', 'e.jpg'))}
+            self.assertEqual(expected, result)
+
+
+if __name__ == '__main__':
+    unittest.main()
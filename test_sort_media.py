@@ -1,10 +1,44 @@
 """Unit tests for the sort_medias module."""
 
+from collections import ChainMap
+import errno
+import io
+import os
+from pathlib import Path
+import struct
+import tempfile
+from typing import Optional
 import unittest
+from unittest import mock
 
+import piexif
+
+import _exif_cache
 import sort_media
 
 
+def make_jpeg(path: str, datetime_original: Optional[bytes],
+              padding: int=0) -> None:
+    """Write a minimal JPEG with EXIF data after padding bytes of APP2."""
+    if datetime_original is None:
+        exif = piexif.dump({'0th': {piexif.ImageIFD.Make: b'Camera'}})
+    else:
+        exif = piexif.dump({'Exif': {sort_media.DATETIME_ORIGINAL:
+                                     datetime_original}})
+
+    with open(path, 'wb') as f:
+        f.write(b'\xff\xd8')
+
+        while padding > 0:
+            length = min(padding, 0xffff)
+            f.write(b'\xff\xe2' + struct.pack('>H', length))
+            f.write(bytes(length - 2))
+            padding -= length
+
+        f.write(b'\xff\xe1' + struct.pack('>H', len(exif) + 2) + exif)
+        f.write(b'\xff\xda' + bytes(1024) + b'\xff\xd9')
+
+
 class TestDateFromFilename(unittest.TestCase):
 
     def test_dates(self):
@@ -44,6 +78,200 @@ class TestDateFromFilename(unittest.TestCase):
                     print(f'ERROR: {test} returned {result}')
 
 
+class TestDateFromExif(unittest.TestCase):
+
+    def test_dates(self):
+        tests = (
+            (('2016', '09'), 0),
+            (('2016', '09'), 2 * sort_media.EXIF_HEAD_SIZE),
+        )
+
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'file.jpg')
+
+            for test in tests:
+                with self.subTest(test=test):
+                    make_jpeg(path, b'2016:09:23 12:00:00', padding=test[1])
+                    self.assertEqual(test[0],
+                                     sort_media.date_from_exif(path))
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'file.jpg')
+            make_jpeg(path, b'2016:09:23 12:00:00')
+            cache = {}
+
+            self.assertEqual(('2016', '09'),
+                             sort_media.date_from_exif(path, cache))
+            self.assertEqual(1, len(cache))
+
+            # A cache hit must not read the file, and is recorded as used
+            entry = next(iter(cache.values()))
+            entry[2:] = ['2000', '01']
+            used = ChainMap({}, cache)
+            self.assertEqual(('2000', '01'),
+                             sort_media.date_from_exif(path, used))
+            self.assertEqual(cache, used.maps[0])
+
+            # A changed file must be read again
+            make_jpeg(path, b'2016:09:23 12:00:00', padding=16)
+            self.assertEqual(('2016', '09'),
+                             sort_media.date_from_exif(path, cache))
+
+    def test_no_date(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'file.jpg')
+
+            for padding in (0, 2 * sort_media.EXIF_HEAD_SIZE):
+                with self.subTest(padding=padding):
+                    make_jpeg(path, None, padding=padding)
+
+                    with self.assertRaises(KeyError):
+                        sort_media.date_from_exif(path)
+
+    def test_inline_value(self):
+        # A value of 4 bytes or fewer is stored inline, not at an offset
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'file.jpg')
+            make_jpeg(path, b'201')
+
+            with open(path, 'rb') as f:
+                self.assertIsNone(sort_media._fast_datetime_original(f.read()))
+
+            self.assertEqual('201', sort_media._read_datetime_original(path))
+
+    def test_not_jpeg(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'file.mp4')
+            Path(path).write_bytes(bytes(1024))
+
+            with self.assertRaises(ValueError):
+                sort_media.date_from_exif(path)
+
+
+class TestCopy(unittest.TestCase):
+
+    def test_copy(self):
+        data = os.urandom(100000)
+
+        for use_sendfile in (sort_media._USE_SENDFILE, False):
+            with self.subTest(use_sendfile=use_sendfile), \
+                    tempfile.TemporaryDirectory() as root:
+                src_file = os.path.join(root, 'file.jpg')
+                dest_dir = os.path.join(root, '2016', '09')
+                dest_file = os.path.join(dest_dir, 'file.jpg')
+                Path(src_file).write_bytes(data)
+                os.utime(src_file, ns=(10**18, 10**18))
+
+                with mock.patch.object(sort_media, '_USE_SENDFILE',
+                                       use_sendfile):
+                    sort_media.copy(src_file, dest_dir, 'copy')
+
+                self.assertEqual(data, Path(dest_file).read_bytes())
+                self.assertEqual(10**18, os.stat(dest_file).st_mtime_ns)
+
+    def test_copy_error(self):
+        with tempfile.TemporaryDirectory() as root:
+            src_file = os.path.join(root, 'file.jpg')
+            dest_file = os.path.join(root, 'dest.jpg')
+            Path(src_file).write_bytes(b'src')
+
+            # Errors other than sendfile being unsupported are raised and
+            # no partial copy is left
+            error = OSError(errno.ENOSPC, 'No space left on device')
+            with mock.patch.object(sort_media, '_USE_SENDFILE', True), \
+                    mock.patch('os.sendfile', side_effect=error, create=True):
+                with self.assertRaises(OSError):
+                    sort_media._copy_file(src_file, dest_file,
+                                          os.stat(src_file))
+
+            self.assertFalse(os.path.exists(dest_file))
+
+            # Unsupported sendfile falls back to shutil
+            error = OSError(errno.EINVAL, 'Invalid argument')
+            with mock.patch.object(sort_media, '_USE_SENDFILE', True), \
+                    mock.patch('os.sendfile', side_effect=error, create=True):
+                sort_media._copy_file(src_file, dest_file, os.stat(src_file))
+
+            self.assertEqual(b'src', Path(dest_file).read_bytes())
+
+    def test_move_existing(self):
+        with tempfile.TemporaryDirectory() as root:
+            src_file = os.path.join(root, 'file.jpg')
+            dest_file = os.path.join(root, 'dest.jpg')
+            Path(src_file).write_bytes(b'src')
+            Path(dest_file).write_bytes(b'dest')
+
+            with self.assertRaises(FileExistsError):
+                sort_media._move_file(src_file, dest_file, os.stat(src_file))
+
+            self.assertEqual(b'src', Path(src_file).read_bytes())
+            self.assertEqual(b'dest', Path(dest_file).read_bytes())
+
+    def test_move_without_link(self):
+        with tempfile.TemporaryDirectory() as root:
+            src_file = os.path.join(root, 'file.jpg')
+            dest_file = os.path.join(root, 'dest.jpg')
+            Path(src_file).write_bytes(b'src')
+
+            # For example a different device or a FAT file system
+            error = OSError(errno.EXDEV, 'Cross-device link')
+            with mock.patch('os.link', side_effect=error):
+                sort_media._move_file(src_file, dest_file, os.stat(src_file))
+
+            self.assertFalse(os.path.exists(src_file))
+            self.assertEqual(b'src', Path(dest_file).read_bytes())
+
+    def test_move_without_hard_links(self):
+        with tempfile.TemporaryDirectory() as root:
+            src_file = os.path.join(root, 'file.jpg')
+            dest_file = os.path.join(root, 'dest.jpg')
+            Path(src_file).write_bytes(b'src')
+
+            # For example FAT, where the file is renamed, not copied
+            error = OSError(errno.EPERM, 'Operation not permitted')
+            with mock.patch('os.link', side_effect=error), \
+                    mock.patch.object(sort_media, '_copy_file') as copy_file:
+                sort_media._move_file(src_file, dest_file, os.stat(src_file))
+
+            copy_file.assert_not_called()
+            self.assertFalse(os.path.exists(src_file))
+            self.assertEqual(b'src', Path(dest_file).read_bytes())
+
+    def test_dest_dir_removed(self):
+        with tempfile.TemporaryDirectory() as root:
+            dest_dir = os.path.join(root, '2016', '09')
+
+            # The destination directory is created again after it has been
+            # removed, for example by rmdirs() in move mode
+            for name in ('first.jpg', 'second.jpg'):
+                src_file = os.path.join(root, name)
+                Path(src_file).write_bytes(b'src')
+                dest_file = os.path.join(dest_dir, name)
+                with self.assertLogs('copy', 'INFO'):
+                    sort_media.copy(src_file, dest_dir, 'move')
+
+                self.assertTrue(os.path.isfile(dest_file))
+                os.unlink(dest_file)
+                os.rmdir(dest_dir)
+
+    def test_same_file(self):
+        with tempfile.TemporaryDirectory() as root:
+            dest_dir = os.path.join(root, '2016', '09')
+            os.makedirs(dest_dir)
+            dest_file = os.path.join(dest_dir, 'file.jpg')
+            Path(dest_file).write_bytes(b'data')
+
+            # A link to a file already in place is not an error
+            src_file = os.path.join(root, 'file.jpg')
+            os.link(dest_file, src_file)
+
+            with self.assertLogs('copy', 'DEBUG') as logs:
+                sort_media.copy(src_file, dest_dir, 'copy')
+
+            self.assertEqual(['DEBUG'], [r.levelname for r in logs.records])
+
+
 class TestIgnore(unittest.TestCase):
 
     def test_ignored(self):
@@ -64,6 +292,10 @@ class TestIgnore(unittest.TestCase):
             with self.subTest(test=test):
                 self.assertTrue(sort_media.ignore(test))
 
+                # Check the regular expressions agree with the fast path
+                ignored = list(sort_media.IGNORED)
+                self.assertTrue(sort_media.ignore(test, ignored=ignored))
+
     def test_no_ignore(self):
         tests = (
             r'.foo\bar.jpg',
@@ -74,6 +306,139 @@ class TestIgnore(unittest.TestCase):
             with self.subTest(test=test):
                 self.assertFalse(sort_media.ignore(test))
 
+                # Check the regular expressions agree with the fast path
+                ignored = list(sort_media.IGNORED)
+                self.assertFalse(sort_media.ignore(test, ignored=ignored))
+
+
+class TestGetPaths(unittest.TestCase):
+
+    def test_get_paths(self):
+        # Paths without a dot are ignored, so give the root directory one
+        with tempfile.TemporaryDirectory(suffix='.test') as root:
+            files = (
+                os.path.join('2017', '11', 'file.jpg'),
+                os.path.join('2017', 'file.mp4'),
+                os.path.join('Picasa2', 'file.jpg'),
+                os.path.join('Picasa2Albums', 'file.jpg'),
+                os.path.join('.Picasa3Temp', 'file.jpg'),
+                os.path.join('.Picasa3Temp_1', 'file.jpg'),
+                os.path.join('2017', 'Thumbs.db'),
+                'top.jpg',
+            )
+
+            for fname in files:
+                path = Path(root, fname)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.touch()
+
+            expected = {
+                Path(root, '2017', '11', 'file.jpg'),
+                Path(root, '2017', 'file.mp4'),
+                Path(root, 'top.jpg'),
+            }
+
+            # Adjacent ignored directories must all be skipped
+            self.assertEqual(expected, set(sort_media.get_paths(Path(root))))
+
+
+class TestMain(unittest.TestCase):
+
+    def test_same_name(self):
+        # Paths without a dot are ignored, so give the root directory one
+        with tempfile.TemporaryDirectory(suffix='.test') as root:
+            src_dir = os.path.join(root, 'src')
+            dest_dir = os.path.join(root, 'dest')
+            num_files = 20
+
+            for i in range(num_files):
+                path = Path(src_dir, f'cam{i}', 'IMG_20160905.jpg')
+                path.parent.mkdir(parents=True)
+                path.write_bytes(str(i).encode())
+
+            argv = ['sort_media', '-s', src_dir, '-d', dest_dir,
+                    '-m', 'move', '-w', '4']
+            with mock.patch('sys.argv', argv), self.assertLogs(level='INFO'):
+                sort_media.main()
+
+            # Only one file is moved and no file is overwritten
+            moved = os.listdir(os.path.join(dest_dir, '2016', '09'))
+            self.assertEqual(['IMG_20160905.jpg'], moved)
+            self.assertEqual(num_files - 1,
+                             len(list(sort_media.get_paths(Path(src_dir)))))
+
+    def test_move_in_place(self):
+        # Paths without a dot are ignored, so give the root directory one
+        with tempfile.TemporaryDirectory(suffix='.test') as root:
+            expected = set()
+
+            # Each month directory holds only a file for the next month, so
+            # directories are emptied while files are moved into them
+            for month in range(1, 61):
+                src_dir = os.path.join(root, str(2015 + (month - 1) // 12),
+                                       f'{(month - 1) % 12 + 1:02}')
+                year, next_month = 2015 + month // 12, month % 12 + 1
+                name = f'IMG_{year}{next_month:02}01.jpg'
+                path = Path(src_dir, name)
+                path.parent.mkdir(parents=True)
+                path.write_bytes(name.encode())
+                expected.add(Path(root, str(year), f'{next_month:02}', name))
+
+            argv = ['sort_media', '-s', root, '-d', root, '-m', 'move',
+                    '-w', '4']
+            with mock.patch('sys.argv', argv), \
+                    self.assertLogs(level='INFO') as logs:
+                sort_media.main()
+
+            self.assertEqual(['INFO'],
+                             sorted({r.levelname for r in logs.records}))
+            self.assertEqual(expected, set(sort_media.get_paths(Path(root))))
+            self.assertFalse(os.path.exists(os.path.join(root, '2015', '01')))
+
+    def test_dryrun(self):
+        with tempfile.TemporaryDirectory(suffix='.test') as root:
+            src_dir = os.path.join(root, 'src')
+            os.mkdir(src_dir)
+            make_jpeg(os.path.join(src_dir, 'file.jpg'),
+                      b'2016:09:23 12:00:00')
+
+            # A dry run must not write the EXIF cache
+            argv = ['sort_media', '-s', src_dir, '-d', root, '-w', '1']
+            with mock.patch('sys.argv', argv), self.assertLogs(level='INFO'):
+                sort_media.main()
+
+            self.assertEqual(['src'], os.listdir(root))
+
+    def test_move_cache(self):
+        for workers in ('1', '2'):
+            with self.subTest(workers=workers), \
+                    tempfile.TemporaryDirectory(suffix='.test') as root:
+                src_dir = os.path.join(root, 'src')
+                os.mkdir(src_dir)
+                make_jpeg(os.path.join(src_dir, 'file.jpg'),
+                          b'2016:09:23 12:00:00')
+
+                argv = ['sort_media', '-s', src_dir, '-d', root,
+                        '-m', 'move', '-w', workers]
+                with mock.patch('sys.argv', argv), \
+                        self.assertLogs(level='INFO'):
+                    sort_media.main()
+
+                # The cache entry follows the file so a later run over the
+                # destination does not read it again
+                dest_file = os.path.join(root, '2016', '09', 'file.jpg')
+                cache = _exif_cache.open_cache(Path(root))
+                self.assertEqual([os.path.realpath(dest_file)], list(cache))
+
+    def test_workers(self):
+        for workers in ('0', '-1', 'x'):
+            with self.subTest(workers=workers):
+                argv = ['sort_media', '-w', workers]
+                with mock.patch('sys.argv', argv), \
+                        mock.patch('sys.stderr', io.StringIO()), \
+                        self.assertRaises(SystemExit):
+                    sort_media.parse_args()
+
 
 if __name__ == '__main__':
     unittest.main()